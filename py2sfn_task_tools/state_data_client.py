@@ -1,19 +1,91 @@
 """Contains the state data client"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+from functools import partial
 import json
 import os
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, List, Optional
 
 import backoff
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 from .exceptions import NoItemFound
 
-dynamodb = boto3.client(
-    "dynamodb", endpoint_url=os.environ.get("DYNAMODB_ENDPOINT_URL")
+
+def _build_client_config() -> Config:
+    """Build the configuration shared by all the clients.
+
+    Connections are pooled and kept alive so repeated calls from the same process reuse
+    the same HTTPS sockets. Retries and timeouts keep botocore's defaults unless they're
+    overridden with environment variables: ``AWS_RETRY_MODE`` and ``AWS_MAX_ATTEMPTS``
+    (read by botocore itself) and ``SFN_DATA_CONNECT_TIMEOUT`` and
+    ``SFN_DATA_READ_TIMEOUT`` (in seconds).
+
+    Returns:
+        client configuration
+
+    """
+    options = {
+        "max_pool_connections": int(
+            os.environ.get("SFN_DATA_MAX_POOL_CONNECTIONS", 50)
+        ),
+        "tcp_keepalive": True,
+    }
+    for option in ("connect_timeout", "read_timeout"):
+        timeout = os.environ.get(f"SFN_DATA_{option.upper()}")
+        if timeout:
+            options[option] = float(timeout)
+    return Config(**options)
+
+
+#: Configuration shared by all the clients below
+client_config = _build_client_config()
+
+
+def _build_s3_client_config(endpoint_url: Optional[str]) -> Config:
+    """Build the configuration for the S3 clients.
+
+    S3 doesn't require the request body to be signed when it's sent over HTTPS, so
+    payload signing is turned off to skip hashing the (potentially large) item data
+    payloads. It's left on for plain HTTP endpoints because an explicit setting takes
+    precedence over botocore's own scheme check and would send the payload unsigned.
+
+    Args:
+        endpoint_url: S3 endpoint URL, or None to use the default HTTPS endpoint
+
+    Returns:
+        S3 client configuration
+
+    """
+    if endpoint_url is not None and not endpoint_url.startswith("https://"):
+        return client_config.merge(Config(signature_version="s3v4"))
+    return client_config.merge(
+        Config(signature_version="s3v4", s3={"payload_signing_enabled": False})
+    )
+
+
+#: Configuration shared by the S3 clients below
+s3_client_config = _build_s3_client_config(os.environ.get("S3_ENDPOINT_URL"))
+session = boto3.session.Session()
+dynamodb = session.client(
+    "dynamodb",
+    endpoint_url=os.environ.get("DYNAMODB_ENDPOINT_URL"),
+    config=client_config,
+)
+dynamodb_resource = session.resource(
+    "dynamodb",
+    endpoint_url=os.environ.get("DYNAMODB_ENDPOINT_URL"),
+    config=client_config,
+)
+s3 = session.client(
+    "s3", endpoint_url=os.environ.get("S3_ENDPOINT_URL"), config=s3_client_config
+)
+s3_resource = session.resource(
+    "s3", endpoint_url=os.environ.get("S3_ENDPOINT_URL"), config=s3_client_config
 )
-s3 = boto3.client("s3", endpoint_url=os.environ.get("S3_ENDPOINT_URL"))
 
 #: If an item's data is larger than this threshold it will be stored in S3 instead of
 #: DynamoDB. The item limit is 400KB but we'll leave room for other attributes.
@@ -77,9 +149,7 @@ class StateDataClient:
         self.default_table_name = default_table_name
         self.namespace = namespace
         self.ttl_days = ttl_days
-        self.s3_bucket = boto3.resource(
-            "s3", endpoint_url=os.environ.get("S3_ENDPOINT_URL")
-        ).Bucket(s3_bucket)
+        self.s3_bucket = s3_resource.Bucket(s3_bucket)
 
     def table(self, table_name: str) -> "dynamodb.Table":
         """Helper method to create a DynamoDB table object.
@@ -91,9 +161,7 @@ class StateDataClient:
             DynamoDB table object
 
         """
-        return boto3.resource(
-            "dynamodb", endpoint_url=os.environ.get("DYNAMODB_ENDPOINT_URL")
-        ).Table(table_name)
+        return dynamodb_resource.Table(table_name)
 
     def _load_item_data(self, item: Dict) -> Any:
         """Load item data for a given item metadata dict.
@@ -272,7 +340,9 @@ class StateDataClient:
         }
         if len(encoded_data) > ITEM_SIZE_THRESHOLD_BYTES:
             s3_key = f"workflow_state_data/{table_name}/{partition_key}/{index}"
-            self.s3_bucket.put_object(Key=s3_key, Body=bytes(encoded_data))
+            s3.put_object(
+                Bucket=self.s3_bucket.name, Key=s3_key, Body=bytes(encoded_data)
+            )
             item["s3_key"] = s3_key
         else:
             item["data"] = serialized_data
@@ -392,13 +462,62 @@ class StateDataClient:
 
         """
         expires_at = self._get_expires_at()
-        with self.table(self.default_table_name).batch_writer() as batch:
-            for i, data in enumerate(items):
-                batch.put_item(
-                    Item=self._process_item_data(
-                        table_name, partition_key, data, i, expires_at
+        self._batch_put_items(
+            self.default_table_name,
+            (
+                self._process_item_data(table_name, partition_key, data, i, expires_at)
+                for i, data in enumerate(items)
+            ),
+        )
+
+        return {
+            "table_name": self.default_table_name,
+            "partition_key": partition_key,
+            "items": [1] * len(items),
+        }
+
+    @backoff.on_exception(
+        backoff.expo, ClientError, max_tries=5, giveup=_giveup_client_error
+    )
+    async def _put_items_async(
+        self, table_name: str, partition_key: str, items: List[Any]
+    ) -> Dict:
+        """Put multiple items into the table with the given partition key.
+
+        This is the asynchronous counterpart of :py:meth:`._put_items`. Item data that
+        has to be stored in S3 is uploaded concurrently, then the items are written to
+        DynamoDB in batches. See :py:meth:`._put_items` for argument documentation.
+
+        """
+        loop = asyncio.get_running_loop()
+        expires_at = self._get_expires_at()
+        # Don't run more uploads at once than the S3 client has pooled connections,
+        # otherwise surplus connections are discarded instead of being reused
+        with ThreadPoolExecutor(
+            max_workers=client_config.max_pool_connections
+        ) as executor:
+            processed_items = await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        executor,
+                        partial(
+                            self._process_item_data,
+                            table_name,
+                            partition_key,
+                            data,
+                            i,
+                            expires_at,
+                        ),
                     )
+                    for i, data in enumerate(items)
                 )
+            )
+            await loop.run_in_executor(
+                executor,
+                partial(
+                    self._batch_put_items, self.default_table_name, processed_items
+                ),
+            )
 
         return {
             "table_name": self.default_table_name,
@@ -406,6 +525,18 @@ class StateDataClient:
             "items": [1] * len(items),
         }
 
+    def _batch_put_items(self, table_name: str, items: Iterable[Dict]) -> None:
+        """Write processed items to the table in batches.
+
+        Args:
+            table_name: DynamoDB table name
+            items: Items returned by :py:meth:`._process_item_data`
+
+        """
+        with self.table(table_name).batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+
     def put_items(self, key: str, items: List[Dict]) -> Dict:
         """Helper method to put multiple locally-scoped items into the table.
 
@@ -431,6 +562,28 @@ class StateDataClient:
         """
         return self._put_items(table_name, partition_key, items)
 
+    async def put_items_async(self, key: str, items: List[Dict]) -> Dict:
+        """Helper method to asynchronously put multiple locally-scoped items.
+
+        See :py:meth:`.put_items` and :py:meth:`._put_items_async`.
+
+        """
+        result = await self._put_items_async(
+            self.default_table_name, self._get_partition_key(key), items
+        )
+        result["key"] = key
+        return result
+
+    async def put_global_items_async(
+        self, table_name: str, partition_key: str, items: List[Dict]
+    ) -> Dict:
+        """Helper method to asynchronously put multiple globally-scoped items.
+
+        See :py:meth:`.put_global_items` and :py:meth:`._put_items_async`.
+
+        """
+        return await self._put_items_async(table_name, partition_key, items)
+
     def _get_partition_key(self, key: str) -> str:
         """Get a partition key by prefixing the key with the local namespace"""
         return f"{self.namespace}:{key}"
@@ -0,0 +1,45 @@
+"""Configures the environment for the functional tests.
+
+By default the tests run against moto's in-process mocks of DynamoDB and S3. Set
+``RUN_LIVE=1`` to run them against real AWS resources instead.
+"""
+import os
+
+from moto import mock_dynamodb, mock_s3
+
+RUN_LIVE = os.environ.get("RUN_LIVE") == "1"
+
+#: Mocks that are active for the whole test session
+aws_mocks = [] if RUN_LIVE else [mock_dynamodb(), mock_s3()]
+
+
+def pytest_configure(config):
+    """Start the AWS mocks before any test modules are imported.
+
+    The state data client creates its boto3 clients at import time and moto only
+    intercepts requests from clients created after a mock has started. Fake
+    credentials also make sure real AWS resources are never touched. The retry and
+    timeout overrides are set for live runs too.
+    """
+    # Fail fast instead of using the library's default retries and timeouts
+    os.environ.setdefault("AWS_RETRY_MODE", "adaptive")
+    os.environ.setdefault("AWS_MAX_ATTEMPTS", "3")
+    os.environ.setdefault("SFN_DATA_CONNECT_TIMEOUT", "5")
+    os.environ.setdefault("SFN_DATA_READ_TIMEOUT", "10")
+    if RUN_LIVE:
+        return
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
+    os.environ.pop("DYNAMODB_ENDPOINT_URL", None)
+    os.environ.pop("S3_ENDPOINT_URL", None)
+    for aws_mock in aws_mocks:
+        aws_mock.start()
+
+
+def pytest_unconfigure(config):
+    """Stop the AWS mocks"""
+    for aws_mock in aws_mocks:
+        aws_mock.stop()
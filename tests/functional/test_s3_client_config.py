@@ -0,0 +1,54 @@
+import hashlib
+import unittest
+
+from py2sfn_task_tools import state_data_client
+
+
+class _RequestSigned(Exception):
+    """Raised to stop a request once it's been signed, before it's sent"""
+
+
+class S3ClientConfigTests(unittest.TestCase):
+    """Tests for the configuration of the S3 clients"""
+
+    def _get_content_sha256(self, endpoint_url: str) -> str:
+        """Sign a PutObject request with the S3 client config and return its payload hash
+
+        Args:
+            endpoint_url: S3 endpoint URL the request is made against
+
+        Returns:
+            value of the ``X-Amz-Content-SHA256`` header
+
+        """
+        client = state_data_client.session.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            config=state_data_client._build_s3_client_config(endpoint_url),
+        )
+
+        def stop_request(request, **kwargs):
+            raise _RequestSigned(request.headers["X-Amz-Content-SHA256"])
+
+        # The signer is also a request-created handler, so run after it
+        client.meta.events.register_last("request-created", stop_request)
+        with self.assertRaises(_RequestSigned) as cm:
+            client.put_object(Bucket="bucket", Key="key", Body=b"data")
+        return cm.exception.args[0]
+
+    def test_https_payload_unsigned(self):
+        """Should skip hashing the payload over HTTPS"""
+        self.assertIn(
+            "UNSIGNED-PAYLOAD", self._get_content_sha256("https://s3.example.com")
+        )
+
+    def test_http_payload_signed(self):
+        """Should hash the payload over plain HTTP"""
+        self.assertEqual(
+            self._get_content_sha256("http://localhost:4566"),
+            hashlib.sha256(b"data").hexdigest(),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
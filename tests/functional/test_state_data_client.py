@@ -1,74 +1,139 @@
-from random import choice
+import asyncio
+from collections import defaultdict
+import functools
+import hashlib
+import itertools
+import json
+import os
 from string import ascii_lowercase
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable
 import unittest
+from unittest import mock
 import uuid
 
-import boto3
 import botocore
 
+from py2sfn_task_tools import state_data_client
 from py2sfn_task_tools.state_data_client import (
+    dynamodb,
+    dynamodb_resource,
     ITEM_SIZE_THRESHOLD_BYTES,
+    s3,
     StateDataClient,
 )
 
-dynamodb = boto3.client("dynamodb")
+#: Translation table mapping every byte value to a lowercase ASCII letter
+_LOWERCASE_TABLE = bytes(ord(ascii_lowercase[b % 26]) for b in range(256))
 
+#: Counter used to make each large string unique
+_large_string_counter = itertools.count()
 
-def create_table(name: str = None):
-    """Helper function to create a DynamoDB table for testing.
+
+def begin_create_table(name: str = None) -> SimpleNamespace:
+    """Helper function to start creating a DynamoDB table for testing.
 
     This table configuration works with the state data client. All tests can share the
     same table since we'll use a unique execution ID/namespace. The TTL of 1 day will
     ensure the table does not grow indefinitely.
+
+    This doesn't wait for the table to be ready so other resources can be provisioned
+    in the meantime. Pass the returned table to :py:func:`wait_for_table`.
     """
     if name is None:
-        name = f"dev-{uuid.uuid4()}"
-    table = boto3.resource("dynamodb").Table(name)
+        name = f"dev-{uuid.uuid4().hex}"
+    table = SimpleNamespace(name=name, status=None)
     try:
-        dynamodb.create_table(
-            TableName=name,
-            AttributeDefinitions=[
-                {"AttributeName": "partition_key", "AttributeType": "S"},
-                {"AttributeName": "sort_key", "AttributeType": "N"},
-            ],
-            KeySchema=[
-                {"AttributeName": "partition_key", "KeyType": "HASH"},
-                {"AttributeName": "sort_key", "KeyType": "RANGE"},
-            ],
-            BillingMode="PAY_PER_REQUEST",
+        table.status = dynamodb.describe_table(TableName=name)["Table"]["TableStatus"]
+    except dynamodb.exceptions.ResourceNotFoundException:
+        try:
+            dynamodb.create_table(
+                TableName=name,
+                AttributeDefinitions=[
+                    {"AttributeName": "partition_key", "AttributeType": "S"},
+                    {"AttributeName": "sort_key", "AttributeType": "N"},
+                ],
+                KeySchema=[
+                    {"AttributeName": "partition_key", "KeyType": "HASH"},
+                    {"AttributeName": "sort_key", "KeyType": "RANGE"},
+                ],
+                BillingMode="PAY_PER_REQUEST",
+            )
+        except dynamodb.exceptions.ResourceInUseException:
+            # Another test run created the table in the meantime
+            pass
+    return table
+
+
+def wait_for_table(table: SimpleNamespace) -> None:
+    """Helper function to wait for a table to be active and enable its TTL"""
+    if table.status != "ACTIVE":
+        dynamodb.get_waiter("table_exists").wait(
+            TableName=table.name, WaiterConfig={"Delay": 1, "MaxAttempts": 60}
+        )
+    if _is_ttl_enabled(table.name):
+        return
+    try:
+        dynamodb.update_time_to_live(
+            TableName=table.name,
+            TimeToLiveSpecification={"Enabled": True, "AttributeName": "expires_at"},
         )
     except botocore.exceptions.ClientError as e:
-        if e.response["Error"]["Code"] == "ResourceInUseException":
-            # Table exists
-            return table
-        raise
-    table.wait_until_exists()
-    dynamodb.update_time_to_live(
-        TableName=name,
-        TimeToLiveSpecification={"Enabled": True, "AttributeName": "expires_at"},
-    )
-    return table
+        # Another test process may have enabled the TTL in the meantime, in which case
+        # DynamoDB rejects this update
+        code = e.response["Error"]["Code"]
+        if code != "ValidationException" or not _is_ttl_enabled(table.name):
+            raise
 
 
-def create_bucket(name: str = None):
-    """Helper function to create an S3 bucket for testing.
+def _is_ttl_enabled(table_name: str) -> bool:
+    """Check whether a table's TTL is enabled or being enabled"""
+    ttl = dynamodb.describe_time_to_live(TableName=table_name)["TimeToLiveDescription"]
+    return ttl.get("TimeToLiveStatus") in ("ENABLED", "ENABLING")
 
-    This table configuration works with the state data client. All tests can share the
-    same bucket since we'll use a unique execution ID/namespace. The TTL of 1 day will
-    ensure the bucket does not grow indefinitely.
+
+def begin_create_bucket(name: str = None) -> SimpleNamespace:
+    """Helper function to start creating an S3 bucket for testing.
+
+    All tests can share the same bucket since we'll use a unique execution
+    ID/namespace. The lifecycle rule of 1 day will ensure the bucket does not grow
+    indefinitely.
+
+    This doesn't wait for the bucket to exist so other resources can be provisioned
+    in the meantime. Pass the returned bucket to :py:func:`wait_for_bucket`.
     """
     if name is None:
-        name = str(uuid.uuid4())
-    s3 = boto3.resource("s3")
-    bucket = s3.Bucket(name)
+        name = uuid.uuid4().hex
+    bucket = SimpleNamespace(name=name, created=False)
     try:
-        bucket.create(ACL="private")
-        bucket.wait_until_exists()
+        s3.head_bucket(Bucket=name)
     except botocore.exceptions.ClientError as e:
-        if e.response["Error"]["Code"] != "ResourceInUseException":
+        if e.response["Error"]["Code"] != "404":
             raise
+    else:
+        # Bucket exists and was configured when it was created
+        return bucket
+
+    try:
+        s3.create_bucket(Bucket=name, ACL="private")
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] != "BucketAlreadyOwnedByYou":
+            raise
+    bucket.created = True
+    return bucket
 
-    boto3.client("s3").put_public_access_block(
+
+def wait_for_bucket(bucket: SimpleNamespace) -> None:
+    """Helper function to wait for a new bucket to exist and configure it"""
+    if not bucket.created:
+        return
+
+    s3.get_waiter("bucket_exists").wait(
+        Bucket=bucket.name, WaiterConfig={"Delay": 0.5, "MaxAttempts": 60}
+    )
+
+    s3.put_public_access_block(
         Bucket=bucket.name,
         PublicAccessBlockConfiguration={
             "BlockPublicAcls": True,
@@ -78,26 +143,90 @@ def create_bucket(name: str = None):
         },
     )
 
-    bucket_lifecycle_configuration = bucket.LifecycleConfiguration()
-    bucket_lifecycle_configuration.put(
+    s3.put_bucket_lifecycle_configuration(
+        Bucket=bucket.name,
         LifecycleConfiguration={
             "Rules": [
                 {
                     "Expiration": {"Days": 1},
                     "ID": "expiration",
                     "Status": "Enabled",
-                    "Prefix": "",
+                    "Filter": {"Prefix": ""},
                 }
             ]
-        }
+        },
     )
 
-    return bucket
+
+def delete_items(table_name: str, partition_keys: Iterable[str], bucket_name: str):
+    """Helper function to delete test items along with any data offloaded to S3.
+
+    Items are deleted in batches of 25 and S3 objects in batches of 1000, which are the
+    limits of the BatchWriteItem and DeleteObjects APIs.
+    """
+    keys = []
+    s3_keys = []
+    paginator = dynamodb.get_paginator("query")
+    for partition_key in partition_keys:
+        page_iterator = paginator.paginate(
+            TableName=table_name,
+            ProjectionExpression="partition_key, sort_key, s3_key",
+            KeyConditionExpression="partition_key = :partition_key",
+            ExpressionAttributeValues={":partition_key": {"S": partition_key}},
+        )
+        for response in page_iterator:
+            for item in response["Items"]:
+                keys.append(
+                    {
+                        "partition_key": item["partition_key"],
+                        "sort_key": item["sort_key"],
+                    }
+                )
+                if "s3_key" in item:
+                    s3_keys.append(item["s3_key"]["S"])
+
+    for i in range(0, len(keys), 25):
+        request_items = {
+            table_name: [{"DeleteRequest": {"Key": key}} for key in keys[i : i + 25]]
+        }
+        while request_items:
+            response = dynamodb.batch_write_item(RequestItems=request_items)
+            request_items = response["UnprocessedItems"]
+
+    for i in range(0, len(s3_keys), 1000):
+        s3.delete_objects(
+            Bucket=bucket_name,
+            Delete={
+                "Objects": [{"Key": key} for key in s3_keys[i : i + 1000]],
+                "Quiet": True,
+            },
+        )
+
+
+@functools.lru_cache(maxsize=4)
+def _build_random_string(size: int) -> str:
+    """Helper function to generate a random string, cached per size"""
+    return os.urandom(size).translate(_LOWERCASE_TABLE).decode("ascii")
 
 
 def _build_large_string(size: int = int(1.25 * ITEM_SIZE_THRESHOLD_BYTES)):
-    """Helper function to generate a large random string"""
-    return "".join([choice(ascii_lowercase) for _ in range(size)])
+    """Helper function to generate a large string.
+
+    The random body is only generated once per size. A counter suffix keeps each
+    returned string distinct.
+    """
+    return _build_random_string(size - 4) + f"{next(_large_string_counter):04d}"
+
+
+def _digest(data: Any) -> bytes:
+    """Helper function to hash JSON-serializable data.
+
+    Comparing digests of large items avoids diffing hundreds of KB of text when an
+    assertion fails.
+    """
+    return hashlib.blake2b(
+        json.dumps(data, sort_keys=True).encode("utf-8"), digest_size=16
+    ).digest()
 
 
 class StateDataClientFunctionalTests(unittest.TestCase):
@@ -105,35 +234,74 @@ class StateDataClientFunctionalTests(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        """Create DynamoDB tables and state data clients"""
-        cls.source_table = create_table("py2sfn-task-tools-test-source")
-        cls.target_table = create_table("py2sfn-task-tools-test-target")
-        cls.s3_bucket = create_bucket("py2sfn-task-tools-test")
-        cls.test_execution_id = str(uuid.uuid4())
+        """Create the DynamoDB table, S3 bucket and state data clients"""
+        # Request both resources before waiting on either so they're provisioned
+        # concurrently
+        cls.table = begin_create_table("py2sfn-task-tools-test")
+        cls.s3_bucket = begin_create_bucket("py2sfn-task-tools-test")
+        wait_for_table(cls.table)
+        wait_for_bucket(cls.s3_bucket)
+        cls.test_execution_id = uuid.uuid4().hex
+        # Both clients share the table but use separate namespaces, so reading the
+        # source client's items from the target client exercises the global methods
         cls.source_client = StateDataClient(
-            cls.source_table.name,
-            cls.test_execution_id,
+            cls.table.name,
+            f"{cls.test_execution_id}:source",
             ttl_days=1,
             s3_bucket=cls.s3_bucket.name,
         )
         cls.target_client = StateDataClient(
-            cls.target_table.name,
-            cls.test_execution_id,
+            cls.table.name,
+            f"{cls.test_execution_id}:target",
             ttl_days=1,
             s3_bucket=cls.s3_bucket.name,
         )
+        #: (table name, partition key) pairs written by the tests
+        cls.written_partitions = set()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Delete the items and S3 objects created by the tests"""
+        partition_keys_by_table = defaultdict(list)
+        for table_name, partition_key in cls.written_partitions:
+            partition_keys_by_table[table_name].append(partition_key)
+        for table_name, partition_keys in partition_keys_by_table.items():
+            delete_items(table_name, partition_keys, cls.s3_bucket.name)
+
+    def _track(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Record the partition written by a put call so it's deleted after the tests.
+
+        Args:
+            meta: Metadata dict returned by one of the client's ``put_*`` methods
+
+        Returns:
+            the metadata dict, unchanged
+
+        """
+        self.written_partitions.add((meta["table_name"], meta["partition_key"]))
+        return meta
+
+    def _watch_s3_put_object(self):
+        """Wrap the S3 client used to offload item data so its calls are recorded"""
+        s3_client = state_data_client.s3
+        return mock.patch.object(s3_client, "put_object", wraps=s3_client.put_object)
 
     def test_put_and_get_item(self):
-        """Should put and get a local item"""
+        """Should put and get a local item without touching S3"""
         data = {"hello": "local"}
-        meta = self.source_client.put_item(self.id(), data)
+        with self._watch_s3_put_object() as put_object:
+            meta = self._track(self.source_client.put_item(self.id(), data))
+        put_object.assert_not_called()
         self.assertEqual(self.source_client.get_item(meta["key"]), data)
 
     def test_put_and_get_global_item(self):
         """Should put and get a global item"""
+        partition_key = f"{self.source_client.namespace}:{self.id()}"
         data = {"hello": "global"}
-        meta = self.source_client.put_global_item(
-            self.source_table.name, self.id(), data, index=42
+        meta = self._track(
+            self.source_client.put_global_item(
+                self.table.name, partition_key, data, index=42
+            )
         )
         self.assertEqual(
             self.target_client.get_global_item(
@@ -144,29 +312,34 @@ class StateDataClientFunctionalTests(unittest.TestCase):
 
     def test_put_and_get_item_for_map_iteration(self):
         """Should put and get a local map iteration item"""
-        event = {"items_result_key": self.id(), "context_index": 24}
+        key = self.id()
+        partition_key = f"{self.source_client.namespace}:{key}"
+        event = {"items_result_key": key, "context_index": 24}
         data = {"hello": "local"}
         self.assertEqual(
-            self.source_client.put_item_for_map_iteration(event, data),
+            self._track(self.source_client.put_item_for_map_iteration(event, data)),
             {
-                "table_name": self.source_table.name,
-                "partition_key": f"{self.source_client.namespace}:{self.id()}",
-                "key": self.id(),
+                "table_name": self.table.name,
+                "partition_key": partition_key,
+                "key": key,
             },
         )
         self.assertEqual(self.source_client.get_item_for_map_iteration(event), data)
 
     def test_put_and_get_global_item_for_map_iteration(self):
         """Should put and get a global map iteration item"""
+        partition_key = f"{self.source_client.namespace}:{self.id()}"
         event = {
-            "items_result_table_name": self.source_table.name,
-            "items_result_partition_key": self.id(),
+            "items_result_table_name": self.table.name,
+            "items_result_partition_key": partition_key,
             "context_index": 24,
         }
         data = {"hello": "global"}
         self.assertEqual(
-            self.source_client.put_global_item_for_map_iteration(event, data),
-            {"table_name": self.source_table.name, "partition_key": self.id()},
+            self._track(
+                self.source_client.put_global_item_for_map_iteration(event, data)
+            ),
+            {"table_name": self.table.name, "partition_key": partition_key},
         )
         self.assertEqual(
             self.target_client.get_global_item_for_map_iteration(event), data
@@ -174,30 +347,51 @@ class StateDataClientFunctionalTests(unittest.TestCase):
 
     def test_put_and_get_items(self):
         """Should put and get a list of local items"""
+        key = self.id()
+        partition_key = f"{self.source_client.namespace}:{key}"
         items = [{"one": 1}, {"two": 2}]
-        meta = self.source_client.put_items(self.id(), items)
+        meta = self._track(self.source_client.put_items(key, items))
         self.assertEqual(
             meta,
             {
-                "table_name": self.source_table.name,
-                "partition_key": f"{self.source_client.namespace}:{self.id()}",
-                "key": self.id(),
+                "table_name": self.table.name,
+                "partition_key": partition_key,
+                "key": key,
                 "items": [1, 1],
             },
         )
         self.assertEqual(self.source_client.get_items(meta["key"]), items)
 
+    def test_put_items__batched(self):
+        """Should write a list of items with one BatchWriteItem call per 25 items"""
+        items = [{"index": i} for i in range(30)]
+        ddb_client = dynamodb_resource.meta.client
+        with mock.patch.object(
+            ddb_client, "batch_write_item", wraps=ddb_client.batch_write_item
+        ) as batch_write_item:
+            meta = self._track(self.source_client.put_items(self.id(), items))
+        self.assertEqual(
+            [
+                len(kwargs["RequestItems"][self.table.name])
+                for _, kwargs in batch_write_item.call_args_list
+            ],
+            [25, 5],
+        )
+        self.assertEqual(self.source_client.get_items(meta["key"]), items)
+
     def test_put_and_get_global_items(self):
         """Should put and get a list of global items"""
+        key = self.id()
+        partition_key = f"{self.source_client.namespace}:{key}"
         items = [{"one": 1}, {"two": 2}]
-        meta = self.source_client.put_global_items(
-            self.source_table.name, f"{self.source_client.namespace}:{self.id()}", items
+        meta = self._track(
+            self.source_client.put_global_items(self.table.name, partition_key, items)
         )
         self.assertEqual(
             meta,
             {
-                "table_name": self.source_table.name,
-                "partition_key": f"{self.source_client.namespace}:{self.id()}",
+                "table_name": self.table.name,
+                "partition_key": partition_key,
                 "items": [1, 1],
             },
         )
@@ -209,29 +403,78 @@ class StateDataClientFunctionalTests(unittest.TestCase):
         )
 
     def test_put_and_get_item__large(self):
-        """Should put and get a large item"""
+        """Should put and get a large item offloaded to S3"""
         data = {"big": _build_large_string()}
-        meta = self.source_client.put_item(self.id(), data)
-        self.assertEqual(self.source_client.get_item(meta["key"]), data)
+        with self._watch_s3_put_object() as put_object:
+            meta = self._track(self.source_client.put_item(self.id(), data))
+        put_object.assert_called_once()
+        self.assertEqual(
+            _digest(self.source_client.get_item(meta["key"])), _digest(data)
+        )
 
     def test_put_and_get_items__large(self):
         """Should put and get a list of large items intermixed with small ones"""
+        key = self.id()
+        partition_key = f"{self.source_client.namespace}:{key}"
         items = [
             {"one": _build_large_string()},
             {"two": "lil"},
             {"three": _build_large_string()},
         ]
-        meta = self.source_client.put_items(self.id(), items)
+        meta = self._track(self.source_client.put_items(key, items))
         self.assertEqual(
             meta,
             {
-                "table_name": self.source_table.name,
-                "partition_key": f"{self.source_client.namespace}:{self.id()}",
-                "key": self.id(),
+                "table_name": self.table.name,
+                "partition_key": partition_key,
+                "key": key,
                 "items": [1, 1, 1],
             },
         )
-        self.assertEqual(self.source_client.get_items(meta["key"]), items)
+        self.assertEqual(
+            [_digest(item) for item in self.source_client.get_items(meta["key"])],
+            [_digest(item) for item in items],
+        )
+
+    def test_put_and_get_items_async__large(self):
+        """Should asynchronously put and get a list of large and small items"""
+        key = self.id()
+        partition_key = f"{self.source_client.namespace}:{key}"
+        items = [
+            {"one": _build_large_string()},
+            {"two": "lil"},
+            {"three": _build_large_string()},
+        ]
+        # Each upload blocks until the other one has started, so the test fails if the
+        # uploads are made one after another
+        uploads_started = threading.Barrier(2, timeout=10)
+        s3_client = state_data_client.s3
+        real_put_object = s3_client.put_object
+
+        def put_object_concurrently(**kwargs):
+            uploads_started.wait()
+            return real_put_object(**kwargs)
+
+        with mock.patch.object(
+            s3_client, "put_object", side_effect=put_object_concurrently
+        ) as put_object:
+            meta = self._track(
+                asyncio.run(self.source_client.put_items_async(key, items))
+            )
+        self.assertEqual(put_object.call_count, 2)
+        self.assertEqual(
+            meta,
+            {
+                "table_name": self.table.name,
+                "partition_key": partition_key,
+                "key": key,
+                "items": [1, 1, 1],
+            },
+        )
+        self.assertEqual(
+            [_digest(item) for item in self.source_client.get_items(meta["key"])],
+            [_digest(item) for item in items],
+        )
 
 
 if __name__ == "__main__":